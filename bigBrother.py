@@ -2,13 +2,18 @@
 
 from trail import *
 from pathway import *
+import pathway
+from telemetry import TelemetryWriter
+from ingest import Ingest
 
 # A few parameters
 VERBOSE = False
 OSC = True
 SHOW_CV = True
+TELEMETRY = False # Publishes the state of the blobs in shared memory, to be read by telemetry.py
 
 MAX_PATHWAY_HISTORY = 300 # Maximum history length for the Pathway objects
+MAX_PATHWAY_DISTANCE = 32 # Search radius (in pixels) around a position for the nearest point of a pathway
 MAX_TRAIL_HISTORY = 50 # Maximum history length for the Trail object
 POINT_LIFETIME = 1e6 # Maximum lifetime (in seconds) of a new position
 LINE_DETECTION_LEVEL = 64 # Maximum indice of confidence for a line to be detected by Trail
@@ -22,6 +27,10 @@ IMAGE_SIZE = [640, 480]
 PROJECTION_IN = array([[0, 0], [640, 0], [640, 480], [0, 480]], float32)
 PROJECTION_OUT = array([[0, 0], [640, 0], [640, 480], [0, 480]], float32)
 
+# Sources: OSC port of each blobserver, and the projection from its camera to the floor
+SOURCES = [[9000, PROJECTION_IN, PROJECTION_OUT]]
+MERGE_DISTANCE = 32 # Maximum distance between two detections of the same blob by different cameras
+
 #*************#
 def bigBrother_callback(path, args, types, src, user_data):
     pathway_callback(path, args, types, src, user_data["pathway"])
@@ -29,10 +38,11 @@ def bigBrother_callback(path, args, types, src, user_data):
 
 #*************#
 def mainLoop(maxPathwayHistory = MAX_PATHWAY_HISTORY, maxTrailHistory = MAX_TRAIL_HISTORY, pointLifetime = POINT_LIFETIME,
-             lineDetectionLevel = LINE_DETECTION_LEVEL, circleDetectionLevel = CIRCLE_DETECTION_LEVEL, circleMaxRadius = CIRCLE_MAX_RADIUS):
+             lineDetectionLevel = LINE_DETECTION_LEVEL, circleDetectionLevel = CIRCLE_DETECTION_LEVEL, circleMaxRadius = CIRCLE_MAX_RADIUS,
+             maxPathwayDistance = MAX_PATHWAY_DISTANCE):
     try:
-        oscServer = liblo.Server(9000);
-    except liblo.AddressError, err:
+        ingest = Ingest(SOURCES, MERGE_DISTANCE)
+    except liblo.ServerError, err:
         print(str(err))
         sys.exit()
 
@@ -42,35 +52,52 @@ def mainLoop(maxPathwayHistory = MAX_PATHWAY_HISTORY, maxTrailHistory = MAX_TRAI
         print(str(err))
         sys.exit()
 
+    if TELEMETRY:
+        telemetry = TelemetryWriter()
+    frame = 0
+
+    # The OpenCV windows of the pathways follow the same switch
+    pathway.SHOW_CV = SHOW_CV
+
     # Set the pathways list
     pathmaps = []
-    pathmaps.append(loadImage("assets/path.png"))
+    pathmaps.append(Pathmap(loadImage("assets/path.png")))
 
     pathways = {}
     trails = {}
+    identities = Identities()
 
     user_data = {}
-    user_data["pathway"] = [pathways, pathmaps, maxPathwayHistory, pointLifetime]
-    user_data["trail"] = [trails, maxTrailHistory, pointLifetime, lineDetectionLevel, circleDetectionLevel, circleMaxRadius]
-    # The positions of the blobs are updated through this callback
-    oscServer.add_method("/blobserver/bgsubtractor", "iiiffiii", bigBrother_callback, user_data)
+    # Positions coming from Ingest are already projected on the floor
+    user_data["pathway"] = [pathways, pathmaps, maxPathwayHistory, pointLifetime, maxPathwayDistance, True]
+    user_data["trail"] = [trails, maxTrailHistory, pointLifetime, lineDetectionLevel, circleDetectionLevel, circleMaxRadius, True]
 
     while True:
         if VERBOSE:
             print("-----------------------")
-        oscServer.recv(33)
+        ingest.recv(33)
+
+        # The positions of the merged blobs are updated through this callback
+        blobs = ingest.update()
+        for i in blobs:
+            bigBrother_callback("/blobserver/bgsubtractor", [i, blobs[i][0], blobs[i][1]], "iff", None, user_data)
 
         #-----#
         # cleanLog contains the list of the blob ID which are not active anymore
         cleanLog = []
+        # Completions and errors of the pathways, kept for the telemetry
+        travels = {}
         for i in pathways:
             if pathways[i][0].isAlive() == False:
                 cleanLog.append(i)
                 continue
 
+            travels[i] = ([], [])
             for j in range(len(pathways[i])):
                 # Update of the completion of the pathways, for each blob and each pathmap
                 completion, error = pathways[i][j].travel()
+                travels[i][0].append(completion)
+                travels[i][1].append(error)
                 if VERBOSE:
                    print(i, j, completion, error)
                 if OSC:
@@ -90,33 +117,40 @@ def mainLoop(maxPathwayHistory = MAX_PATHWAY_HISTORY, maxTrailHistory = MAX_TRAI
 
             # Line trails are updated first
             sol, res = trails[i][0].track()
-            eq = trails[i][0].identify().T
+            line = trails[i][0].identify().T
             if VERBOSE:
-                print(eq, res)
-            if OSC and len(eq) == 1:
+                print(line, res)
+            if OSC and len(line) == 1:
                 # OSC message: blobID, slope, delta at x=0
-                liblo.send(oscClient, "/bigBrother/trail", "iff", i, eq[0][0], eq[0][1])
+                liblo.send(oscClient, "/bigBrother/trail", "iff", i, line[0][0], line[0][1])
 
             # Then, circle trails
             sol, res = trails[i][1].track()
-            eq = trails[i][1].identify().T
+            circle = trails[i][1].identify().T
             if VERBOSE:
-                print(eq, res)
-            if OSC and len(eq) == 1:
+                print(circle, res)
+            if OSC and len(circle) == 1:
                 # OSC message: blobID, center_x, center_y, radius, completeness
-                liblo.send(oscClient, "/bigBrother/trail_circle", "iffff", i, eq[0][0], eq[0][1], eq[0][2], eq[0][3])
+                liblo.send(oscClient, "/bigBrother/trail_circle", "iffff", i, circle[0][0], circle[0][1], circle[0][2], circle[0][3])
+
+            if TELEMETRY:
+                completions, errors = travels.get(i, ([], []))
+                telemetry.publish(frame, i, trails[i][1]._rawPoints, trails[i][1]._usedLength,
+                                  line, circle, completions, errors)
 
         for i in cleanLog:
             trails.pop(i)
 
         if SHOW_CV:
-            drawTrails(trails)
+            drawTrails(trails, identities.update(trails))
 
         if SHOW_CV:
             key = cv.waitKey(5)
             if key == 1048603:
                 break;
 
+        frame += 1
+
 #*************#
 if __name__ == "__main__":
     mainLoop()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+import liblo
+import sys
+import cv2 as cv
+from select import select
+from time import time, sleep
+from numpy import *
+
+VERBOSE = False
+
+# Sources: one per camera, each with its own blobserver. Each source is described by
+# the OSC port its blobserver sends to, and the projection from the camera to the floor
+SOURCES = [[9000, array([[0, 0], [640, 0], [640, 480], [0, 480]], float32), array([[0, 0], [640, 0], [640, 480], [0, 480]], float32)]]
+
+# Maximum distance (on the floor) between two detections of the same blob by different cameras
+MERGE_DISTANCE = 32
+# Maximum time (in seconds) a detection is kept without update. Sources are not synchronized,
+# so detections of a same blob by different cameras rarely arrive at the same time
+MAX_DETECTION_AGE = 0.2
+
+#*************#
+# Listens to several blobservers, projects their blobs on the floor and merges
+# the detections of a same blob by different cameras
+class Ingest(object):
+    # Constructor of the class
+    def __init__(self, sources = SOURCES, mergeDistance = MERGE_DISTANCE, maxAge = MAX_DETECTION_AGE):
+        self._servers = []
+        self._projectionMats = []
+        self._mergeDistance = mergeDistance
+        self._maxAge = maxAge
+        self._maxLifetime = 30
+
+        # Last position and time of each detection, keyed by (source, blobId),
+        # and the detections updated since the last merge
+        self._detections = {}
+        self._updated = set()
+
+        # Global IDs, keyed by (source, blobId), and the tick they were last seen at
+        self._globalIds = {}
+        self._lastSeen = {}
+        self._nextId = 0
+        self._tick = 0
+
+        for index in range(len(sources)):
+            server = liblo.Server(sources[index][0])
+            server.add_method("/blobserver/bgsubtractor", "iiiffiii", self.__callback, index)
+            self._servers.append(server)
+            self._projectionMats.append(cv.getPerspectiveTransform(sources[index][1], sources[index][2]))
+
+    # Callback used by liblo, when a new blob position is received from one of the sources
+    def __callback(self, path, args, types, src, source):
+        point = array([[[args[1], args[2]]]], float32)
+        point = cv.perspectiveTransform(point, self._projectionMats[source])
+        self._detections[(source, args[0])] = (point[0][0], time())
+        self._updated.add((source, args[0]))
+
+    # Waits for new messages from any source, for at most timeout milliseconds
+    def recv(self, timeout):
+        ready = select(self._servers, [], [], timeout / 1000.0)[0]
+        for server in ready:
+            while server.recv(0):
+                pass
+
+    # Groups the detections closer than the merge distance to any detection of a group,
+    # at most one per source. Detections are stored in a spatial hash grid with cells as
+    # wide as the merge distance, so that only the neighbouring cells have to be checked
+    def __merge(self):
+        grid = {}
+        clusters = []
+
+        for key in sorted(self._detections.keys()):
+            pos = self._detections[key][0]
+            cell = (int(floor(pos[0] / self._mergeDistance)), int(floor(pos[1] / self._mergeDistance)))
+
+            nearest = None
+            minDist = self._mergeDistance
+            for i in range(cell[0] - 1, cell[0] + 2):
+                for j in range(cell[1] - 1, cell[1] + 2):
+                    for other, index in grid.get((i, j), []):
+                        if key[0] in clusters[index]["sources"]:
+                            continue
+                        dist = sqrt(pow(pos[0] - other[0], 2.0) + pow(pos[1] - other[1], 2.0))
+                        if dist <= minDist:
+                            nearest = index
+                            minDist = dist
+
+            if nearest is None:
+                nearest = len(clusters)
+                clusters.append({"sum": zeros(2), "members": [], "sources": set()})
+
+            cluster = clusters[nearest]
+            cluster["sum"] += pos
+            cluster["members"].append(key)
+            cluster["sources"].add(key[0])
+            grid.setdefault(cell, []).append((pos, nearest))
+
+        return clusters
+
+    # Merges the last known detections, and returns the position of each merged blob
+    # updated since the last call, keyed by a global ID which stays the same as long
+    # as one of its detections keeps being tracked
+    def update(self):
+        self._tick += 1
+        blobs = {}
+
+        # Detections not updated for too long are not merged anymore
+        currentTime = time()
+        cleanLog = []
+        for key in self._detections:
+            if currentTime - self._detections[key][1] > self._maxAge:
+                cleanLog.append(key)
+        for key in cleanLog:
+            self._detections.pop(key)
+
+        usedIds = set()
+        for cluster in self.__merge():
+            # The oldest global ID not already used during this update is kept
+            ids = sorted(set([self._globalIds[key] for key in cluster["members"] if self._globalIds.has_key(key)]))
+            ids = [globalId for globalId in ids if globalId not in usedIds]
+            if len(ids) > 0:
+                globalId = ids[0]
+            else:
+                globalId = self._nextId
+                self._nextId += 1
+            usedIds.add(globalId)
+
+            for key in cluster["members"]:
+                self._globalIds[key] = globalId
+                self._lastSeen[key] = self._tick
+
+            # Only blobs with new positions are returned
+            if len(self._updated.intersection(cluster["members"])) > 0:
+                blobs[globalId] = cluster["sum"] / len(cluster["members"])
+
+        # Blobs not seen for too long are forgotten
+        cleanLog = []
+        for key in self._lastSeen:
+            if self._tick - self._lastSeen[key] > self._maxLifetime:
+                cleanLog.append(key)
+        for key in cleanLog:
+            self._lastSeen.pop(key)
+            self._globalIds.pop(key)
+
+        self._updated = set()
+        return blobs
+
+#*************#
+def mainLoop(mergeDistance = MERGE_DISTANCE):
+    try:
+        ingest = Ingest(SOURCES, mergeDistance)
+    except liblo.ServerError, err:
+        print(str(err))
+        sys.exit()
+
+    while True:
+        if VERBOSE:
+            print("-----------------------")
+        ingest.recv(33)
+
+        blobs = ingest.update()
+        for i in blobs:
+            print(i, blobs[i][0], blobs[i][1])
+
+#*************#
+def usage():
+    print("Usage: ingest.py [mergeDistance]")
+
+#*************#
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and (sys.argv[1] == "-h" or sys.argv[1] == "--help"):
+        print("Ingest, a small script which merges the blobs from several blobservers")
+        usage()
+        sys.exit()
+
+    mergeDistance = MERGE_DISTANCE
+
+    try:
+        mergeDistance = float(sys.argv[1])
+    except:
+        usage()
+
+    mainLoop(mergeDistance)
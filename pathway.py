@@ -4,6 +4,7 @@ import liblo
 import sys
 import cv2 as cv
 from copy import deepcopy
+from heapq import heapify, heappush, heappop
 from time import time, sleep
 from numpy import *
 
@@ -18,6 +19,11 @@ IMAGE_SIZE = [640, 480]
 PROJECTION_IN = array([[0, 0], [640, 0], [640, 480], [0, 480]], float32)
 PROJECTION_OUT = array([[0, 0], [640, 0], [640, 480], [0, 480]], float32)
 
+# Maximum number of pixels used to compute the coverage of a pathway. Bigger pathmaps
+# are evaluated on a coarser level of their pyramid, smaller ones (like the 640x480
+# assets/path.png) at full resolution
+COVERAGE_MAX_PIXELS = 1024 * 1024
+
 #*************#
 class TimedPoint(object):
     def __init__(self, point):
@@ -33,11 +39,64 @@ class ProjectedPoint(object):
         self.distance = distance
         self.time = time
 
+#*************#
+# A pathmap, stored as a pyramid: each level halves the resolution of the previous one,
+# and each of its pixels holds the number of path pixels it covers at full resolution.
+# It is built once per pathmap, and shared read-only by all the Pathway objects following it
+class Pathmap(object):
+    # Constructor of the class
+    def __init__(self, path):
+        level = array(path != 0, uint8)
+        level.flags.writeable = False
+        self._totalPath = int(count_nonzero(level))
+        self._levels = [level]
+
+        # Each level uses the smallest integer type holding the number of pixels a cell covers
+        cellPixels = 1
+        while level.shape[0] > 1 or level.shape[1] > 1:
+            cellPixels *= 4
+            if cellPixels <= iinfo(uint8).max:
+                levelType = uint8
+            elif cellPixels <= iinfo(uint16).max:
+                levelType = uint16
+            else:
+                levelType = uint32
+
+            padded = zeros((level.shape[0] + level.shape[0] % 2, level.shape[1] + level.shape[1] % 2), levelType)
+            padded[:level.shape[0], :level.shape[1]] = level
+            padded = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+            level = padded.sum(axis=3, dtype=levelType).sum(axis=1, dtype=levelType)
+            level.flags.writeable = False
+            self._levels.append(level)
+
+        # The coverage is computed on the first level small enough
+        self._coverageLevel = 0
+        while self._levels[self._coverageLevel].size > COVERAGE_MAX_PIXELS and self._coverageLevel < len(self._levels) - 1:
+            self._coverageLevel += 1
+
+    # Returns the given level of the pyramid, 0 being the full resolution
+    def level(self, index):
+        return self._levels[index]
+
+    # Returns the number of levels of the pyramid
+    def depth(self):
+        return len(self._levels)
+
+    # Returns the number of path pixels at full resolution
+    def totalPath(self):
+        return self._totalPath
+
+    # Returns the level the coverage of a pathway is computed on
+    def coverageLevel(self):
+        return self._coverageLevel
+
 #*************#
 # The class which compares an object's path to a pathway
+# Searches are done coarse-to-fine on the pyramid of the pathmap, and the coverage is
+# computed on a level small enough to keep its cost independent of the pathmap resolution
 class Pathway(object):
     # Constructor of the class
-    def __init__(self, maxHistoryLength, maxTime, args = []):
+    def __init__(self, maxHistoryLength, maxTime, args = [], maxDistance = 32):
         self._history = []
         self._maxLength = maxHistoryLength
         self._maxTime = maxTime
@@ -48,29 +107,67 @@ class Pathway(object):
         self._updated = False
         self._lifetime = 30
 
-        self._maxDistance = 32
+        self._maxDistance = maxDistance
         self._margin = 8
+        self._coarseRadius = 8 # Search radius on the coarsest level used for the search
+        self._farDistance = 255 # Distance given to points with no path nearby
 
         self._traveled = 0.0
         self._error = 1e100
 
-        self._path = zeros((512, 512))
-
-        self._mask = self.__createDistanceMask(self._maxDistance)
-        self._negMask = ones((self._maxDistance * 2 + 1, self._maxDistance * 2 + 1)) * 255
+        self._pathmap = None
+        self._searchLevel = 0
 
         self._projectionMat = array([])
 
-    # This creates a mask where each pixel contains its own distance to the center
-    def __createDistanceMask(self, size):
-        mask = zeros((self._maxDistance * 2 + 1, self._maxDistance * 2 + 1))
-
-        for i in range(-self._maxDistance, self._maxDistance + 1):
-            for j in range(-self._maxDistance, self._maxDistance + 1):
-                distance = sqrt(i*i + j*j)
-                mask[i + self._maxDistance][j + self._maxDistance] = distance
-
-        return mask
+    # Returns the distance from pos (in full resolution coordinates) to the pixels covered by
+    # a cell of the given level. It is a lower bound of the distance to any path pixel in the cell,
+    # and the exact distance to the pixel on the full resolution level
+    def __cellDistance(self, level, pos, x, y):
+        scale = 1 << level
+        dx = max(x * scale - pos[0], 0, pos[0] - (x + 1) * scale + 1)
+        dy = max(y * scale - pos[1], 0, pos[1] - (y + 1) * scale + 1)
+        return sqrt(dx * dx + dy * dy)
+
+    # Checks whether a cell of the given level covers some pixels of the search window
+    def __inWindow(self, level, x, y, window):
+        scale = 1 << level
+        return x * scale <= window[2] and (x + 1) * scale - 1 >= window[0] and y * scale <= window[3] and (y + 1) * scale - 1 >= window[1]
+
+    # Finds the projection of pos on the path, in a window of maxDistance around it.
+    # Cells of the pyramid are explored starting on a coarse level, nearest lower bound first,
+    # and are replaced by their children until a full resolution pixel comes first: as no other
+    # cell can hold a nearer path pixel, it is the exact nearest one
+    def __nearestPath(self, pos):
+        window = (pos[0] - self._maxDistance, pos[1] - self._maxDistance, pos[0] + self._maxDistance, pos[1] + self._maxDistance)
+
+        level = self._searchLevel
+        scale = 1 << level
+        image = self._pathmap.level(level)
+        xMin = max(window[0], 0) // scale
+        yMin = max(window[1], 0) // scale
+        xMax = min(window[2] // scale, image.shape[1] - 1)
+        yMax = min(window[3] // scale, image.shape[0] - 1)
+
+        cells = []
+        ys, xs = nonzero(image[yMin:yMax + 1, xMin:xMax + 1])
+        for x, y in zip(xs + xMin, ys + yMin):
+            cells.append((self.__cellDistance(level, pos, x, y), level, y, x))
+        heapify(cells)
+
+        while len(cells) > 0:
+            distance, level, y, x = heappop(cells)
+            if level == 0:
+                return [int(x), int(y)], distance
+
+            level -= 1
+            image = self._pathmap.level(level)
+            for j in (y * 2, y * 2 + 1):
+                for i in (x * 2, x * 2 + 1):
+                    if j < image.shape[0] and i < image.shape[1] and image[j, i] != 0 and self.__inWindow(level, i, j, window):
+                        heappush(cells, (self.__cellDistance(level, pos, i, j), level, j, i))
+
+        return [pos[0], pos[1]], self._farDistance
 
     def updateProjection(self, inPoints, outPoints):
         self._projectionMat = cv.getPerspectiveTransform(inPoints, outPoints)
@@ -91,22 +188,13 @@ class Pathway(object):
             projPoint = cv.perspectiveTransform(projPoint, self._projectionMat)
             pos = array(projPoint[0][0], integer)
 
-        minDist = self._margin + self._maxDistance
-        if pos[0] < minDist or pos[0] > self._path.shape[0] - minDist or pos[1] < minDist or pos[1] > self._path.shape[0] - minDist:
+        pos = [int(pos[0]), int(pos[1])]
+        shape = self._pathmap.level(0).shape
+        if pos[0] < 0 or pos[0] >= shape[1] or pos[1] < 0 or pos[1] >= shape[0]:
             return
 
-        ixgrid = ix_(range(pos[1] - self._maxDistance, pos[1] + self._maxDistance + 1),
-                     range(pos[0] - self._maxDistance, pos[0] + self._maxDistance + 1))
-        local = self._path[ixgrid]
-        outMat = cv.multiply(local, self._mask)
-        outMat = outMat + cv.multiply(1 - local, self._negMask)
-
-        distance = amin(outMat)
-        index = argmin(outMat)
-        projection = [mod(index, self._maxDistance * 2 + 1), floor(index / (self._maxDistance * 2 + 1))]
-        projection[0] = int(projection[0] - self._maxDistance + pos[0])
-        projection[1] = int(projection[1] - self._maxDistance + pos[1])
-        
+        projection, distance = self.__nearestPath(pos)
+
         if len(self._history) > 0:
             lastProjection = self._history[len(self._history)-1].projection
             dist = sqrt(pow(projection[0] - lastProjection[0], 2.0) + pow(projection[1] - lastProjection[1], 2.0))
@@ -129,14 +217,17 @@ class Pathway(object):
 
         self._updated = True
 
-    # Sets the grayscale image which describes the pathway
+    # Sets the pathmap describing the pathway. It can be given as a grayscale image,
+    # from which a Pathmap is built, but sharing the Pathmap is much cheaper
     def setPath(self, path):
-        newPath = zeros((path.shape[0], path.shape[1]))
-        for i in range(path.shape[0]):
-            for j in range(path.shape[1]):
-                if path[i][j] != 0:
-                    newPath[i][j] = 1
-        self._path = newPath
+        if not isinstance(path, Pathmap):
+            path = Pathmap(path)
+        self._pathmap = path
+
+        # The search starts on the first level where the search window is small enough
+        self._searchLevel = 0
+        while self._maxDistance >> self._searchLevel > self._coarseRadius and self._searchLevel < path.depth() - 1:
+            self._searchLevel += 1
 
     # Computes the completion of a pathway according to the history of positions, as well as
     # the squared sum of the error of these positions (which gives an indication of how well
@@ -147,23 +238,28 @@ class Pathway(object):
             return self._traveled, self._error
         self._lifetime = self._maxLifetime
 
-        pathMask = zeros(self._path.shape)
+        # Rectangles are drawn on the coverage level, each of its pixels being
+        # weighted by the number of path pixels it covers. On a coarse level, rectangles
+        # are grown to whole cells: every path pixel of a partially covered cell counts as
+        # traveled, which overestimates the completion by up to (scale - 1) pixels per side
+        scale = 1 << self._pathmap.coverageLevel()
+        counts = self._pathmap.level(self._pathmap.coverageLevel())
+        pathMask = zeros(counts.shape)
 
         for i in arange(len(self._history) - 1):
-            pos1 = (self._history[i].projection[0], self._history[i].projection[1])
-            pos2 = (self._history[i+1].projection[0], self._history[i+1].projection[1])
-            pos1 = (min(pos1[0], pos2[0]) - self._margin, min(pos1[1], pos2[1]) - self._margin)
-            pos2 = (max(pos1[0], pos2[0]) + self._margin, max(pos1[1], pos2[1]) + self._margin)
+            proj1 = self._history[i].projection
+            proj2 = self._history[i+1].projection
+            pos1 = ((min(proj1[0], proj2[0]) - self._margin) // scale, (min(proj1[1], proj2[1]) - self._margin) // scale)
+            pos2 = ((max(proj1[0], proj2[0]) + self._margin) // scale, (max(proj1[1], proj2[1]) + self._margin) // scale)
             cv.rectangle(pathMask, pos1, pos2, (1), -1)
 
-        path = cv.multiply(pathMask, self._path)
-        totalPath = sum(self._path)
+        path = multiply(pathMask, counts)
         travelPath = sum(path)
-        pathTraveled = travelPath / totalPath
+        pathTraveled = travelPath / self._pathmap.totalPath()
 
         if SHOW_CV:
             cv.imshow("pathMask", pathMask)
-            cv.imshow("traveled", path)
+            cv.imshow("traveled", minimum(path, 1.0))
 
         sqSum = 0
         for i in arange(len(self._history)):
@@ -185,15 +281,19 @@ def pathway_callback(path, args, types, src, user_data):
     pathmaps = user_data[1]
     maxHistory = user_data[2]
     pointLifetime = user_data[3]
+    maxDistance = user_data[4]
+    # Positions may already be projected (by Ingest), in which case they are not projected again
+    projected = len(user_data) > 5 and user_data[5]
 
     # If this blobId is new, we create has many new pathway objects as there are pathmaps
     if pathways.has_key(blobId) == False:
         index = 0
         pathways[blobId] = []
         for path in pathmaps:
-            pathways[blobId].append(Pathway(maxHistory, pointLifetime))
+            pathways[blobId].append(Pathway(maxHistory, pointLifetime, [], maxDistance))
             pathways[blobId][index].setPath(path)
-            pathways[blobId][index].updateProjection(PROJECTION_IN, PROJECTION_OUT)
+            if not projected:
+                pathways[blobId][index].updateProjection(PROJECTION_IN, PROJECTION_OUT)
             index += 1
 
     tPoint = TimedPoint(blobPos)
@@ -209,7 +309,7 @@ def loadImage(path):
     return img
 
 #*************#
-def mainLoop(maxHistory = 300, pointLifetime = 1e6):
+def mainLoop(maxHistory = 300, pointLifetime = 1e6, maxDistance = 32):
     try:
         oscServer = liblo.Server(9000);
     except liblo.AddressError, err:
@@ -219,11 +319,11 @@ def mainLoop(maxHistory = 300, pointLifetime = 1e6):
     # The list containing all possible pathways.
     # Here, only one is loaded
     pathmaps = []
-    pathmaps.append(loadImage("assets/path.png"))
+    pathmaps.append(Pathmap(loadImage("assets/path.png")))
 
     # This dict contains one list of Pathway (the class) per blob ID
     pathways = {}
-    user_data = [pathways, pathmaps, maxHistory, pointLifetime]
+    user_data = [pathways, pathmaps, maxHistory, pointLifetime, maxDistance]
 
     # The positions of the blobs are updated through this callback
     oscServer.add_method("/blobserver/bgsubtractor", "iiiffiii", pathway_callback, user_data)
@@ -255,7 +355,7 @@ def mainLoop(maxHistory = 300, pointLifetime = 1e6):
 
 #*************#
 def usage():
-    print("Usage: pathway.py [maxHistory [pointLifetime]]")
+    print("Usage: pathway.py [maxHistory [pointLifetime [maxDistance]]]")
 
 #*************#
 if __name__ == "__main__":
@@ -266,11 +366,13 @@ if __name__ == "__main__":
 
     maxHistory = 300
     pointLifetime = 1e6
+    maxDistance = 32
 
     try:
         maxHistory = sys.argv[1]
         pointLifetime = sys.argv[2]
+        maxDistance = int(sys.argv[3])
     except:
         usage()
 
-    mainLoop(maxHistory, pointLifetime)
+    mainLoop(maxHistory, pointLifetime, maxDistance)
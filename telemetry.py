@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import cv2 as cv
+from time import time, sleep
+from numpy import *
+
+# Shared memory file the telemetry is published to
+TELEMETRY_PATH = "/dev/shm/bigBrother_telemetry"
+
+# Layout of the ring buffer
+TELEMETRY_SLOTS = 256 # Number of records in the ring buffer
+TELEMETRY_HISTORY = 64 # Number of history points kept per record
+TELEMETRY_PATHWAYS = 8 # Number of pathways kept per record
+
+TELEMETRY_MAGIC = 0x42425452
+TELEMETRY_VERSION = 2
+
+# Input resolution (from camera)
+IMAGE_SIZE = [640, 480]
+
+#*************#
+# The header, at the beginning of the shared memory. head is the total number
+# of records written so far, the last one being at index (head - 1) % slots
+HEADER_TYPE = dtype([("magic", uint32), ("version", uint32),
+                     ("slots", uint32), ("historyLength", uint32), ("pathways", uint32),
+                     ("head", uint64)], align = True)
+
+# Each record holds the state of one blob, for one frame. sequence is odd while
+# the record is being written, so that readers can detect torn records. error is stored
+# as float64, as Pathway starts with an error of 1e100
+def recordType(historyLength, pathways):
+    return dtype([("sequence", uint64), ("frame", uint64), ("time", float64),
+                  ("blobId", int32), ("historyCount", int32), ("history", float32, (historyLength, 2)),
+                  ("usedLength", int32), ("lineValid", uint8), ("circleValid", uint8),
+                  ("line", float32, 2), ("circle", float32, 4),
+                  ("pathwayCount", int32), ("completion", float32, pathways), ("error", float64, pathways)],
+                 align = True)
+
+#*************#
+# Publishes the state of the blobs into a shared memory ring buffer
+class TelemetryWriter(object):
+    # Constructor of the class
+    def __init__(self, path = TELEMETRY_PATH, slots = TELEMETRY_SLOTS, historyLength = TELEMETRY_HISTORY, pathways = TELEMETRY_PATHWAYS):
+        self._slots = slots
+        self._historyLength = historyLength
+        self._pathways = pathways
+        self._recordType = recordType(historyLength, pathways)
+
+        # The file is never truncated nor shrunk, as readers may still have it mapped
+        size = HEADER_TYPE.itemsize + slots * self._recordType.itemsize
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+
+        self._memory = memmap(path, uint8, "r+", shape = (size,))
+        self._memory[:] = 0
+        self._header = self._memory[:HEADER_TYPE.itemsize].view(HEADER_TYPE)
+        self._records = self._memory[HEADER_TYPE.itemsize:].view(self._recordType)
+
+        self._header["magic"] = TELEMETRY_MAGIC
+        self._header["version"] = TELEMETRY_VERSION
+        self._header["slots"] = slots
+        self._header["historyLength"] = historyLength
+        self._header["pathways"] = pathways
+        self._header["head"] = 0
+
+    # Writes the state of a blob in the next slot of the ring buffer
+    # history is the array of the raw positions of the blob (Trail._rawPoints),
+    # line and circle are the outputs of Trail.identify and Trail_Circle.identify,
+    # completions and errors the outputs of Pathway.travel for each pathway
+    def publish(self, frame, blobId, history, usedLength, line, circle, completions = [], errors = []):
+        head = int(self._header["head"][0])
+        index = head % self._slots
+        records = self._records
+
+        sequence = records["sequence"][index]
+        records["sequence"][index] = sequence + 1
+
+        # The record is always closed, so that its sequence stays even once written
+        try:
+            points = history[max(len(history) - self._historyLength, 0):]
+            records["frame"][index] = frame
+            records["time"][index] = time()
+            records["blobId"][index] = blobId
+            records["historyCount"][index] = len(points)
+            records["history"][index][0:len(points)] = points
+            records["usedLength"][index] = usedLength
+
+            records["lineValid"][index] = len(line) != 0
+            if len(line) != 0:
+                records["line"][index] = ravel(line)[0:2]
+            records["circleValid"][index] = len(circle) != 0
+            if len(circle) != 0:
+                records["circle"][index] = ravel(circle)[0:4]
+
+            count = min(len(completions), self._pathways)
+            records["pathwayCount"][index] = count
+            records["completion"][index][0:count] = completions[0:count]
+            records["error"][index][0:count] = errors[0:count]
+        finally:
+            records["sequence"][index] = sequence + 2
+            self._header["head"] = head + 1
+
+#*************#
+# Attaches to the ring buffer published by a TelemetryWriter. The records are
+# mapped directly from the shared memory, nothing is copied
+class TelemetryReader(object):
+    # Constructor of the class
+    def __init__(self, path = TELEMETRY_PATH):
+        self._memory = memmap(path, uint8, "r")
+        self._header = self._memory[:HEADER_TYPE.itemsize].view(HEADER_TYPE)
+        if self._header["magic"][0] != TELEMETRY_MAGIC or self._header["version"][0] != TELEMETRY_VERSION:
+            raise ValueError("Unknown telemetry format in " + path)
+
+        self._slots = int(self._header["slots"][0])
+        self._recordType = recordType(int(self._header["historyLength"][0]), int(self._header["pathways"][0]))
+        size = self._slots * self._recordType.itemsize
+        self._records = self._memory[HEADER_TYPE.itemsize:HEADER_TYPE.itemsize + size].view(self._recordType)
+
+    # Returns the total number of records written so far
+    def head(self):
+        return int(self._header["head"][0])
+
+    # Returns the records, as a view on the shared memory
+    def records(self):
+        return self._records
+
+    # Returns the indices of the records written between the heads given, oldest first
+    # Records overwritten in the meantime are skipped
+    def since(self, head, last):
+        # The writer has been restarted
+        if head > last:
+            head = 0
+        first = max(head, last - self._slots)
+        return [i % self._slots for i in range(first, last)]
+
+    # Checks that the record at index has been entirely written, and not modified
+    # since sequence was read
+    def isValid(self, index, sequence):
+        return sequence % 2 == 0 and self._records["sequence"][index] == sequence
+
+#*************#
+# Draws the last state of each blob, like trail.drawTrails does
+def drawRecords(reader, records):
+    img = zeros((IMAGE_SIZE[1], IMAGE_SIZE[0], 3))
+    for index in records:
+        sequence = reader.records()["sequence"][index]
+        record = reader.records()[index]
+
+        count = record["historyCount"]
+        usedLength = min(record["usedLength"], count)
+        history = array(record["history"][0:count], int32)
+        line = array(record["line"])
+        circle = array(record["circle"])
+        lineValid = record["lineValid"]
+        circleValid = record["circleValid"]
+
+        if not reader.isValid(index, sequence):
+            continue
+
+        if lineValid:
+            start = (0, int(line[1]))
+            end = (IMAGE_SIZE[0], int(line[0] * IMAGE_SIZE[0] + line[1]))
+            cv.line(img, start, end, (255, 255, 0))
+
+        if circleValid:
+            center = (int(circle[0]), int(circle[1]))
+            cv.circle(img, center, int(circle[2]), (255, 255, 255))
+            cv.putText(img, str(circle[3]), center, cv.FONT_HERSHEY_PLAIN, 1, (255, 255, 255))
+
+        if count - usedLength > 0:
+            cv.polylines(img, [history[0:count - usedLength]], False, (255, 0, 0))
+        if usedLength > 0:
+            cv.polylines(img, [history[count - usedLength:count]], False, (0, 0, 255))
+
+    cv.imshow("Telemetry", img)
+
+#*************#
+def mainLoop(path = TELEMETRY_PATH):
+    try:
+        reader = TelemetryReader(path)
+    except (IOError, OSError, ValueError), err:
+        print(str(err))
+        sys.exit()
+
+    head = reader.head()
+    while True:
+        # Only the last record of each blob is drawn
+        last = reader.head()
+        indices = reader.since(head, last)
+        head = last
+        if len(indices) > 0:
+            latest = {}
+            for index in indices:
+                latest[reader.records()["blobId"][index]] = index
+            drawRecords(reader, latest.values())
+
+        key = cv.waitKey(33)
+        if key == 1048603:
+            break
+
+#*************#
+def usage():
+    print("Usage: telemetry.py [path]")
+
+#*************#
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and (sys.argv[1] == "-h" or sys.argv[1] == "--help"):
+        print("Telemetry, a small viewer for the telemetry published by bigBrother")
+        usage()
+        sys.exit()
+
+    path = TELEMETRY_PATH
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+
+    mainLoop(path)
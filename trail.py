@@ -33,6 +33,7 @@ class Trail(object):
     def __init__(self, maxHistoryLength, maxTime, args = []):
         self._history = []
         self._rawHistory = []
+        self._rawPoints = zeros((0, 2), float32) # Positions of _rawHistory, as an array
         self._maxLength = maxHistoryLength
         self._maxTime = maxTime
         self._args = args
@@ -47,6 +48,12 @@ class Trail(object):
         self._res = 0
         self._usedLength = 0
 
+        # The result of identify is cached, and only recomputed when the version changes,
+        # that is when new samples are added and when the path is tracked from them
+        self._version = 0
+        self._identity = array([])
+        self._identityVersion = -1
+
         self._projectionMat = array([])
 
     # This method is the one which does the computation
@@ -59,6 +66,11 @@ class Trail(object):
         res = result[1]
         return sol, sqrt(res / len(a))
 
+    # Updates the cached result of identify
+    def __cacheIdentity(self):
+        self._identity = self._computeIdentity()
+        self._identityVersion = self._version
+
     def updateProjection(self, inPoints, outPoints):
         self._projectionMat = cv.getPerspectiveTransform(inPoints, outPoints)
 
@@ -72,24 +84,40 @@ class Trail(object):
         newPoint = self.transformPoint(newPoint)
         self._history.append(newPoint)
         self._rawHistory.append(point) # We keep the original points, may be useful
+        self._rawPoints = append(self._rawPoints, [point.point[0:2]], axis = 0)
 
         while len(self._history) > self._maxLength:
             self._history.remove(self._history[0])
             self._rawHistory.remove(self._rawHistory[0])
+            self._rawPoints = self._rawPoints[1:]
 
         while True:
             currentTime = self._history[len(self._history) - 1].time
             if time() - self._history[0].time > self._maxTime:
                 self._history.remove(self._history[0])
                 self._rawHistory.remove(self._rawHistory[0])
+                self._rawPoints = self._rawPoints[1:]
             else:
                 break
 
         self._updated = True
+        self._version += 1
 
     # Returns the parameters of the path, depending of the shape to follow
-    # For the base class, it returns the parameters for the equation of a line
+    # The result is computed once per track(), or after new samples have been added
     def identify(self):
+        if self._identityVersion != self._version:
+            self.__cacheIdentity()
+        return self._identity
+
+    # Returns the version of the trail, which changes with new samples and with each
+    # track() computed from them
+    def version(self):
+        return self._version
+
+    # Computes the parameters of the path
+    # For the base class, it returns the parameters for the equation of a line
+    def _computeIdentity(self):
         if len(self._args) > 0 and self._args[0] < self._res:
             return array([])
         return self._sol
@@ -109,8 +137,10 @@ class Trail(object):
             return self._sol, self._res
         self._lifetime = self._maxLifetime
         self._updated = False
+        self._version += 1
 
         if len(self._history) < self._trackLength:
+            self.__cacheIdentity()
             return array([]), 0
 
         a = []
@@ -146,6 +176,7 @@ class Trail(object):
         self._sol = sol
         self._res = res
         self._usedLength = usedLength
+        self.__cacheIdentity()
 
         return sol, res
 
@@ -158,35 +189,26 @@ class Trail(object):
 # Class derived from Trail, but... for circles
 class Trail_Circle(Trail):
     # The returned parameters are different, as we output circles
-    def identify(self):
+    def _computeIdentity(self):
         if len(self._sol) != 3:
             return array([])
 
         sol = self._sol
-        it = []
-        it.append(sol[0])
-        it.append(sol[1])
-        it.append(sqrt(pow(sol[0], 2.0) + pow(sol[1], 2.0) - sol[2]))
+        radius = sqrt(pow(sol[0], 2.0) + pow(sol[1], 2.0) - sol[2])
 
-        if len(self._args) > 0 and it[2] > self._args[0]:
+        if len(self._args) > 0 and radius > self._args[0]:
             return array([])
 
         if len(self._args) > 1 and self._res > self._args[1]:
             return array([])
 
         # We compute the completeness of the circle
-        points = []
-        for i in range(len(self._rawHistory) - self._usedLength, len(self._rawHistory)):
-            vec = []
-            vec.append(self._rawHistory[i].point[0])
-            vec.append(self._rawHistory[i].point[1])
-            points.append(vec)
-        points = array(points)
+        points = self._rawPoints[len(self._rawPoints) - self._usedLength:]
         center = array([sol[0], sol[1]]).T
         meanDist = sqrt(sum(power(sum(points - center, 0) / self._trackLength, 2)))
-        it.append(meanDist / it[2]) # We divide by the radius of the detected circle
 
-        return array(it)
+        # We divide by the radius of the detected circle
+        return array([sol[0], sol[1], radius, meanDist / radius])
 
     # The points are transformed into a linear space which makes it
     # easier to detect circles. See http://www.math.sunysb.edu/~scott/Book331/Fitting_circle.html
@@ -212,58 +234,106 @@ def trail_callback(path, args, types, src, user_data):
     lineDetectionLevel = user_data[3]
     circleDetectionLevel = user_data[4]
     circleMaxRadius = user_data[5]
+    # Positions may already be projected (by Ingest), in which case they are not projected again
+    projected = len(user_data) > 6 and user_data[6]
 
     if trails.has_key(blobId) == False:
         # We set in this list all the shapes we want to detect
         trails[blobId] = [Trail(maxHistory, pointLifetime, [lineDetectionLevel]), 
                           Trail_Circle(maxHistory, pointLifetime, [circleMaxRadius, circleDetectionLevel])]
-        for i in range(len(trails[blobId])):
-            trails[blobId][i].updateProjection(PROJECTION_IN, PROJECTION_OUT)
+        if not projected:
+            for i in range(len(trails[blobId])):
+                trails[blobId][i].updateProjection(PROJECTION_IN, PROJECTION_OUT)
 
     tPoint = TimedPoint(blobPos)
     trails[blobId][0].follow(tPoint);
     trails[blobId][1].follow(tPoint);
 
 #*************#
-# Draws all recognized shapes
-def drawTrails(trails):
+# Layout of the array kept by Identities, with one element per blob
+IDENTITY_TYPE = dtype([("blobId", int32), ("usedLength", int32),
+                       ("lineVersion", int64), ("circleVersion", int64),
+                       ("lineValid", bool_), ("line", float64, 2),
+                       ("circleValid", bool_), ("circle", float64, 4)])
+
+#*************#
+# Keeps the results of identify for all blobs in a single structured array.
+# The row of a blob is only rebuilt when the version of one of its trails changed
+class Identities(object):
+    # Constructor of the class
+    def __init__(self):
+        self._identities = zeros(0, IDENTITY_TYPE)
+        self._rows = {}
+
+    # Updates the array from the trails, and returns it
+    def update(self, trails):
+        # The rows are reordered when blobs appear or disappear
+        reorder = len(trails) != len(self._identities)
+        for i in trails:
+            if reorder or self._rows.has_key(i) == False:
+                reorder = True
+                break
+
+        if reorder:
+            identities = zeros(len(trails), IDENTITY_TYPE)
+            identities["lineVersion"] = -1
+            identities["circleVersion"] = -1
+            rows = {}
+            index = 0
+            for i in trails:
+                if self._rows.has_key(i):
+                    identities[index] = self._identities[self._rows[i]]
+                rows[i] = index
+                index += 1
+            self._identities = identities
+            self._rows = rows
+
+        identities = self._identities
+        for i in trails:
+            index = self._rows[i]
+            if identities["lineVersion"][index] == trails[i][0].version() and identities["circleVersion"][index] == trails[i][1].version():
+                continue
+
+            line = trails[i][0].identify()
+            circle = trails[i][1].identify()
+            identities["blobId"][index] = i
+            identities["usedLength"][index] = trails[i][1]._usedLength
+            identities["lineVersion"][index] = trails[i][0].version()
+            identities["circleVersion"][index] = trails[i][1].version()
+            identities["lineValid"][index] = len(line) != 0
+            if len(line) != 0:
+                identities["line"][index] = ravel(line)
+            identities["circleValid"][index] = len(circle) != 0
+            if len(circle) != 0:
+                identities["circle"][index] = ravel(circle)
+
+        return identities
+
+#*************#
+# Draws all recognized shapes, from the array returned by Identities.update
+def drawTrails(trails, identities):
     img = zeros((IMAGE_SIZE[1], IMAGE_SIZE[0], 3))
-    for i in trails:
-        line = trails[i][0].identify()
-        if len(line) == 0:
-            continue
-        start = (0, line[1])
-        end = (IMAGE_SIZE[0], line[0] * IMAGE_SIZE[0] + line[1])
+
+    for line in identities["line"][identities["lineValid"]]:
+        start = (0, int(line[1]))
+        end = (IMAGE_SIZE[0], int(line[0] * IMAGE_SIZE[0] + line[1]))
         cv.line(img, start, end, (255, 255, 0))
 
-    for i in trails:
-        circle = trails[i][1].identify()
-        if len(circle) == 0:
-            continue
-        center = (circle[0], circle[1])
-        radius = circle[2]
+    for identity in identities[identities["circleValid"]]:
+        i = int(identity["blobId"])
+        circle = identity["circle"]
+        center = (int(circle[0]), int(circle[1]))
+        radius = int(circle[2])
         cv.circle(img, center, radius, (255, 255, 255))
 
-        cv.putText(img, str(circle[3][0]), (circle[0], circle[1]), cv.FONT_HERSHEY_PLAIN, 1, (255, 255, 255))
+        cv.putText(img, str(circle[3]), center, cv.FONT_HERSHEY_PLAIN, 1, (255, 255, 255))
 
-        contours = []
-        #for index in range(0, len(trails[i][1]._rawHistory)):
-        for index in range(len(trails[i][1]._rawHistory) - trails[i][1]._usedLength, len(trails[i][1]._rawHistory)):
-            vec = []
-            for j in range(0, len(trails[i][1]._rawHistory[index].point)):
-                vec.append(trails[i][1]._rawHistory[index].point[j])
-            contours.append(vec)
-        if len(contours) > 0:
-            cv.polylines(img, [array(contours, int32)], False, (0, 0, 255))
-
-        contours = []
-        for index in range(0, len(trails[i][1]._rawHistory) - trails[i][1]._usedLength):
-            vec = []
-            for j in range(0, len(trails[i][1]._rawHistory[index].point)):
-                vec.append(trails[i][1]._rawHistory[index].point[j])
-            contours.append(vec)
-        if len(contours) > 0:
-            cv.polylines(img, [array(contours, int32)], False, (255, 0, 0))
+        points = array(trails[i][1]._rawPoints, int32)
+        usedLength = trails[i][1]._usedLength
+        if usedLength > 0:
+            cv.polylines(img, [points[len(points) - usedLength:]], False, (0, 0, 255))
+        if len(points) - usedLength > 0:
+            cv.polylines(img, [points[0:len(points) - usedLength]], False, (255, 0, 0))
 
     cv.imshow("Trails", img)
 
@@ -280,6 +350,7 @@ def mainLoop(maxHistory = 50, pointLifetime = 1e6, lineDetectionLevel = 64, circ
         sys.exit()
 
     trails = {}
+    identities = Identities()
     user_data = [trails, maxHistory, pointLifetime, lineDetectionLevel, circleDetectionLevel, circleMaxRadius]
     # Position of the blobs is set using a callback of liblo
     oscServer.add_method("/blobserver/bgsubtractor", "iiiffiii", trail_callback, user_data)
@@ -307,7 +378,7 @@ def mainLoop(maxHistory = 50, pointLifetime = 1e6, lineDetectionLevel = 64, circ
             trails.pop(i)
 
         if SHOW_CV:
-            drawTrails(trails)
+            drawTrails(trails, identities.update(trails))
 
         cv.waitKey(5)
         FRAMENUMBER += 1